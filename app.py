@@ -1,633 +1,810 @@
 import os
 import sys
+import asyncio
 import subprocess
 import tempfile
 import shutil
+import threading
 import traceback
 import logging
+import logging.handlers
 import hashlib
-from flask import Flask, request, jsonify, send_file, render_template
+import base64
+import uuid
+import struct
+import time
+from functools import lru_cache
+import aiofiles
+from quart import Quart, Response, request, jsonify, render_template
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import FileTarget, ValueTarget
 
-# Configure logging to show errors in terminal
+# Configure logging to show errors in terminal (LOG_LEVEL=WARNING quiets production)
+log_stream = logging.StreamHandler(sys.stdout)
+log_stream.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+# Batch stdout writes - flushed every 100 records, on errors and at the end of each request/job
+log_buffer = logging.handlers.MemoryHandler(capacity=100, flushLevel=logging.ERROR, target=log_stream)
 logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
+    level=os.environ.get('LOG_LEVEL', 'DEBUG').upper(),
+    handlers=[log_buffer]
 )
 logger = logging.getLogger(__name__)
 
 # Import CORS - make it optional for environments where it's not installed
 try:
-    from flask_cors import CORS  # type: ignore
+    from quart_cors import cors  # type: ignore
     cors_available = True
 except ImportError:
     cors_available = False
-    CORS = None  # type: ignore
-    print("Warning: flask-cors not installed. CORS support disabled.")
+    cors = None  # type: ignore
+    print("Warning: quart-cors not installed. CORS support disabled.")
 
-app = Flask(__name__)
-if cors_available and CORS:
-    CORS(app)  # Enable CORS for all routes
-app.config['MAX_CONTENT_LENGTH'] = 150 * 1024 * 1024  # 150MB max file size (Render free tier optimized)
+# Import BLAKE3 - optional, hashlib's BLAKE2 is used when it's not installed
+try:
+    from blake3 import blake3  # type: ignore
+    HASH_NAME = 'BLAKE3'
+except ImportError:
+    blake3 = None  # type: ignore
+    HASH_NAME = 'BLAKE2b'
+    print("Warning: blake3 not installed. Falling back to BLAKE2b for upload hashing.")
+
+app = Quart(__name__)
+if cors_available and cors:
+    app = cors(app)  # Enable CORS for all routes
+MAX_UPLOAD_SIZE = 150 * 1024 * 1024  # 150MB max file size (Render free tier optimized)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE  # Quart raises 413 once the request body passes this
+app.config['BODY_TIMEOUT'] = 300  # Allow slow 150MB uploads (Quart default is 60s)
+app.config['RESPONSE_TIMEOUT'] = 300  # Allow slow downloads of the protected file
 app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching for file downloads
 
 # Path to dpt.jar
 DPT_JAR_PATH = os.path.join(os.path.dirname(__file__), 'executable', 'dpt.jar')
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+# Multipart upload parsing (streamed straight from the request body to disk)
+UPLOAD_CHUNK_SIZE = 1 << 20  # Request body is fed to the parser in 1MB batches
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # Protected file is streamed back in 1MB chunks (~150 reads for 150MB)
+FORM_FIELDS = (
+    'use_protect_config',
+    'debug',
+    'disable_acf',
+    'dump_code',
+    'exclude_abis',
+    'keep_classes',
+    'noisy_log',
+    'smaller',
+)
+# Form switch -> dpt.jar flag, appended when the field is 'true'
+OPTION_FLAGS = (
+    ('debug', '--debug'),
+    ('disable_acf', '--disable-acf'),
+    ('dump_code', '--dump-code'),
+    ('keep_classes', '-K'),
+    ('noisy_log', '--noisy-log'),
+    ('smaller', '-S'),
+)
 
-@app.route('/protect', methods=['POST'])
-def protect_apk():
+# Pre-warmed JVM pool - executable/worker/DptWorker.java, compiled at build time
+DPT_WORKER_DIR = os.path.join(os.path.dirname(__file__), 'executable', 'worker')
+DPT_WORKER_CLASS = os.path.join(DPT_WORKER_DIR, 'DptWorker.class')
+DPT_POOL_SIZE = int(os.environ.get('DPT_POOL_SIZE', 1))  # Each JVM is ~100MB+ idle - raise only when RAM allows
+dpt_pool = None  # Started in before_serving when Java and the compiled worker are available
+
+# Where job workspaces are created. Opt-in tmpfs (e.g. WORKSPACE_DIR=/dev/shm) keeps the APK and
+# dpt.jar's unpacked build off the disk, but every job (up to ~450MB) then counts against
+# the container's memory limit - only set it when RAM allows
+WORKSPACE_DIR = os.environ.get('WORKSPACE_DIR')
+
+# Background protection jobs - POST /protect returns a job ID, GET /protect/<job_id> collects the result
+JOB_RESULT_TTL = 600  # Seconds a finished job is kept for collection before its files are removed
+protection_jobs = {}
+
+class ProtectionJob:
+    """A dpt.jar run submitted through POST /protect"""
+
+    def __init__(self, temp_dir, output_filename):
+        self.id = uuid.uuid4().hex
+        self.temp_dir = temp_dir
+        self.output_filename = output_filename
+        self.task = None
+        self.output_file = None
+        self.file_size = 0
+        self.error = None  # (error payload, status code) when the job failed
+
+class HashingFileTarget(FileTarget):
+    """FileTarget that hashes and size-limits the upload while it is written to disk"""
+
+    def __init__(self, filename, *args, max_size=None, **kwargs):
+        super().__init__(filename, *args, **kwargs)
+        self.hash = blake3() if blake3 else hashlib.blake2b()
+        self.max_size = max_size
+        self.size = 0
+        self.finished = False  # Only set once the part's closing boundary has been parsed
+
+    def on_data_received(self, chunk):
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            # Reject mid-stream instead of saving an upload that will be refused anyway
+            raise RequestEntityTooLarge()
+        self.hash.update(chunk)
+        super().on_data_received(chunk)
+
+    def on_finish(self):
+        self.finished = True
+        super().on_finish()
+
+def discard_dir(path):
+    """Remove a job directory off the critical path: O(1) rename now, rmtree in a background thread"""
+    trash = path + '.trash'
     try:
-        logger.info("=" * 60)
-        logger.info("Acx Shell - APK Protection Request Received")
-        logger.info("=" * 60)
-        
-        # Check if file is present
-        if 'apk_file' not in request.files:
-            error_msg = 'No APK file provided'
-            logger.error(f"ERROR: {error_msg}")
-            return jsonify({'error': error_msg}), 400
-        
-        file = request.files['apk_file']
-        if file.filename == '':
-            error_msg = 'No file selected'
-            logger.error(f"ERROR: {error_msg}")
-            return jsonify({'error': error_msg}), 400
-        
-        if not file.filename.lower().endswith(('.apk', '.aab')):
-            error_msg = 'Invalid file type. Only APK and AAB files are supported'
-            logger.error(f"ERROR: {error_msg}")
-            return jsonify({'error': error_msg}), 400
-        
-        logger.info(f"Processing file: {file.filename}")
-        
-        # Validate file size before processing (150MB limit for Render free tier)
-        # Read file content length from request
-        file.seek(0, os.SEEK_END)
-        file_size_bytes = file.tell()
-        file.seek(0)  # Reset to beginning
-        max_size = 150 * 1024 * 1024  # 150MB limit for free tier
-        
-        if file_size_bytes > max_size:
-            error_msg = f'File size ({file_size_bytes / (1024*1024):.2f} MB) exceeds maximum allowed size (150 MB) for free tier. Please use a smaller APK file.'
-            logger.error(f"ERROR: {error_msg}")
-            return jsonify({'error': error_msg}), 400
-        
-        logger.info(f"File size validated: {file_size_bytes / (1024*1024):.2f} MB (within 150MB free tier limit)")
-        
-        # Calculate file hash to prevent duplicate protection
-        file.seek(0)
-        file_content = file.read()
-        file.seek(0)  # Reset for later use
-        file_hash = hashlib.md5(file_content).hexdigest()
-        logger.info(f"File hash (MD5): {file_hash}")
-        
-        # Check if file was already protected (check if filename starts with "protected_")
-        original_filename = file.filename
-        if original_filename.startswith('protected_'):
-            error_msg = 'This file appears to be already protected. Please upload the original APK file, not the protected version.'
-            logger.warning(f"Duplicate protection attempt detected: {original_filename}")
-            return jsonify({'error': error_msg}), 400
+        os.rename(path, trash)
+    except FileNotFoundError:
+        return  # Already gone
+    except OSError as e:
+        # Rename refused (e.g. a Windows sharing violation) - still remove what we can in place
+        logger.warning("Could not rename %s for cleanup: %s", path, e)
+        trash = path
+    # dump-code trees can hold thousands of files - don't make the response wait on the unlinks
+    threading.Thread(target=shutil.rmtree, args=(trash,), kwargs={'ignore_errors': True}, daemon=True).start()
+
+class ProtectionWorkspace:
+    """Per-request temp directory, discarded on exit unless a job takes it over"""
+
+    def __init__(self):
+        self.temp_dir = None
+        self.output_dir = None
+
+    @staticmethod
+    def base_dir():
+        """WORKSPACE_DIR when set, otherwise /tmp or the system temp"""
+        if WORKSPACE_DIR:
+            return WORKSPACE_DIR
+        # Use /tmp on Render for better performance, fallback to system temp (Windows compatible)
+        return '/tmp' if os.path.exists('/tmp') else tempfile.gettempdir()
+
+    def __enter__(self):
+        temp_base = self.base_dir()
+        self.temp_dir = tempfile.mkdtemp(prefix='apk_protect_', dir=temp_base)
+        self.output_dir = os.path.join(self.temp_dir, 'output')
+        os.makedirs(self.output_dir, exist_ok=True)
+        return self
+
+    def detach(self):
+        """Hand temp_dir over to the caller, who becomes responsible for removing it"""
+        temp_dir, self.temp_dir = self.temp_dir, None
+        return temp_dir
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.temp_dir:
+            discard_dir(self.temp_dir)
+        return False
+
+async def stream_file(path, cleanup_dir=None):
+    """Yield a file from disk in chunks, removing cleanup_dir once it has been sent"""
+    try:
+        async with aiofiles.open(path, 'rb') as f:
+            while chunk := await f.read(DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+    finally:
+        if cleanup_dir:
+            discard_dir(cleanup_dir)
+
+async def run_command(cmd, timeout, cwd=None, env=None):
+    """Run a command without blocking the event loop (async subprocess.run with capture_output=True, text=True)"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        env=env
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # Do not leave the child running if we time out or the client goes away
+        proc.kill()
+        await proc.wait()
+        raise
+    return subprocess.CompletedProcess(
+        cmd,
+        proc.returncode,
+        stdout.decode(errors='replace'),
+        stderr.decode(errors='replace')
+    )
+
+def resolve_java_cmd():
+    """Resolve the java executable from JAVA_HOME, falling back to PATH (Windows compatible)"""
+    java_exe = 'java.exe' if os.name == 'nt' else 'java'
+    java_path = os.environ.get('JAVA_HOME', '')
+    if java_path:
+        # Windows uses 'bin\java.exe', Linux/Mac uses 'bin/java'
+        java_cmd = os.path.join(java_path, 'bin', java_exe)
+        if os.path.exists(java_cmd):
+            return java_cmd
+    return java_exe
+
+def probe_java():
+    """Run `java -version` once and return (java_cmd, java_available, java_version)"""
+    java_cmd = resolve_java_cmd()
+    try:
+        result = subprocess.run(
+            [java_cmd, '-version'],
+            capture_output=True,
+            text=True,
+            timeout=5
+        )
+        java_version = result.stderr.split('\n')[0] if result.stderr else 'Unknown'
+        return java_cmd, True, java_version
+    except Exception as e:
+        logger.warning("Java check failed (%s): %s", java_cmd, e)
+        return java_cmd, False, 'Not found'
+
+# The Java install doesn't change while the server runs, so probe it once at startup
+JAVA_CMD, JAVA_AVAILABLE, JAVA_VERSION = probe_java()
+
+class DptWorkerPool:
+    """Long-lived JVMs running DptWorker, so each job skips JVM startup"""
+
+    def __init__(self, java_cmd, size):
+        self.java_cmd = java_cmd
+        self.size = size
+        self.workers = asyncio.Queue()  # Idle workers
+        self.procs = set()  # Every live worker, idle or busy
+
+    async def start(self):
+        for _ in range(self.size):
+            self.workers.put_nowait(await self._spawn())
+        logger.info("Started %s pre-warmed dpt.jar worker(s)", self.size)
+
+    async def stop(self):
+        # Busy workers too - a job still running at shutdown must not outlive the server
+        for worker in list(self.procs):
+            if worker.returncode is None:
+                worker.terminate()
+                await worker.wait()
+        self.procs.clear()
+
+    async def _spawn(self):
+        worker = await asyncio.create_subprocess_exec(
+            self.java_cmd, '-cp', DPT_WORKER_DIR, 'DptWorker', DPT_JAR_PATH,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE
+        )
+        self.procs.add(worker)
+        return worker
+
+    async def run(self, args, log_path, tmp_dir, timeout):
+        """Run one dpt.jar job on a pooled JVM (returns a CompletedProcess like run_command, or None if all are busy)"""
+        try:
+            worker = self.workers.get_nowait()
+        except asyncio.QueueEmpty:
+            # Don't queue behind other jobs - waiting here isn't covered by the timeout
+            return None
+        try:
+            if worker.returncode is not None:
+                logger.warning("dpt.jar worker exited, starting a new one")
+                self.procs.discard(worker)
+                worker = await self._spawn()
+            
+            job = ' '.join(base64.b64encode(arg.encode()).decode() for arg in [log_path, tmp_dir, *args])
+            worker.stdin.write(job.encode() + b'\n')
+            await worker.stdin.drain()
+            status = await asyncio.wait_for(self._wait_done(worker), timeout=timeout)
+        except BaseException:
+            # Worker state is unknown (timeout, cancelled request, broken pipe) - replace it on next use
+            if worker.returncode is None:
+                worker.kill()
+                await worker.wait()
+            raise
+        finally:
+            self.workers.put_nowait(worker)
+        
+        async with aiofiles.open(log_path, 'r', errors='replace') as f:
+            output = await f.read()
+        return subprocess.CompletedProcess(args, 0 if status == 'OK' else 1, output, '')
+
+    @staticmethod
+    async def _wait_done(worker):
+        # Anything else on stdout (e.g. JVM warnings) is not part of the reply
+        while line := await worker.stdout.readline():
+            line = line.decode(errors='replace').strip()
+            if line.startswith('DONE '):
+                return line[len('DONE '):]
+        raise RuntimeError('dpt.jar worker exited unexpectedly')
+
+def find_output_file(output_dir, input_file_path):
+    """Locate dpt.jar's output package, preferring the signed one"""
+    # dpt.jar names the output after the input file, so try the expected names first
+    stem, ext = os.path.splitext(os.path.basename(input_file_path))
+    for name in (f"{stem}_signed{ext}", f"{stem}{ext}"):
+        expected = os.path.join(output_dir, name)
+        if os.path.isfile(expected):
+            return expected
+    
+    # Fall back to a single pass over output_dir (no recursion into subdirectories)
+    unsigned = None
+    try:
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(('.apk', '.aab')):
+                    logger.info("Found potential output file: %s", entry.path)
+                    if '_signed' in entry.name:
+                        return entry.path
+                    unsigned = unsigned or entry.path
+    except OSError as e:
+        logger.warning("Could not scan output directory %s: %s", output_dir, e)
+    return unsigned
+
+APK_SIG_BLOCK_MAGIC = b'APK Sig Block 42'
+ZIP_EOCD_MAGIC = b'PK\x05\x06'
+ZIP_EOCD_MAX_SIZE = 22 + 0xFFFF  # Fixed EOCD record plus the longest possible ZIP comment
+
+def has_apk_signing_block(path):
+    """Check for a v2+ APK Signing Block right before the ZIP central directory"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - ZIP_EOCD_MAX_SIZE))
+        tail = f.read()
+        eocd = tail.rfind(ZIP_EOCD_MAGIC)
+        if eocd < 0 or len(tail) - eocd < 22:
+            return False
+        # The signing block ends with its magic immediately before the central directory
+        central_dir_offset = struct.unpack_from('<I', tail, eocd + 16)[0]
+        if central_dir_offset < len(APK_SIG_BLOCK_MAGIC):
+            return False
+        f.seek(central_dir_offset - len(APK_SIG_BLOCK_MAGIC))
+        return f.read(len(APK_SIG_BLOCK_MAGIC)) == APK_SIG_BLOCK_MAGIC
+
+@app.before_serving
+async def start_dpt_pool():
+    global dpt_pool
+    if DPT_POOL_SIZE < 1 or not JAVA_AVAILABLE or not os.path.exists(DPT_WORKER_CLASS):
+        logger.info("dpt.jar worker pool disabled - each request starts its own JVM")
+        return
+    try:
+        pool = DptWorkerPool(JAVA_CMD, DPT_POOL_SIZE)
+        await pool.start()
+        dpt_pool = pool
+    except Exception as e:
+        logger.warning("Could not start dpt.jar worker pool: %s", e)
+
+@app.before_serving
+async def flush_startup_logs():
+    # Runs after start_dpt_pool - show startup logs without waiting for the first request
+    log_buffer.flush()
+
+@app.after_serving
+async def stop_dpt_pool():
+    if dpt_pool:
+        await dpt_pool.stop()
+
+async def run_protection(job, cmd, dpt_args, input_file_path, output_dir, use_pool):
+    """Run dpt.jar for a job - returns None on success or an (error payload, status code) tuple"""
+    try:
+        logger.info("Starting APK protection process...")
+        logger.info("Working directory: %s", job.temp_dir)
+        result = None
+        if use_pool:
+            # Pooled JVMs share one working directory, so dump-code runs keep their own JVM in temp_dir
+            result = await dpt_pool.run(
+                dpt_args,
+                log_path=os.path.join(job.temp_dir, 'dpt.log'),
+                tmp_dir=job.temp_dir,  # dpt.jar's dptOut workspace, private to this job
+                timeout=300  # 5 minutes timeout (Render free tier optimized)
+            )
+            if result is None:
+                logger.info("All dpt.jar workers busy - starting a separate JVM")
+            else:
+                logger.info("Ran on a pre-warmed dpt.jar worker")
+        if result is None:
+            result = await run_command(
+                cmd,
+                timeout=300,  # 5 minutes timeout (Render free tier optimized)
+                cwd=job.temp_dir  # Run from temp directory (the JVM's default user.dir)
+            )
         
-        # Create temporary directory for processing (Windows compatible)
-        # Use /tmp on Render for better performance, fallback to system temp
-        if os.path.exists('/tmp'):
-            temp_base = '/tmp'
-        else:
-            temp_base = tempfile.gettempdir()
-        temp_dir = tempfile.mkdtemp(prefix='apk_protect_', dir=temp_base)
-        input_file_path = os.path.join(temp_dir, secure_filename(file.filename))
-        output_dir = os.path.join(temp_dir, 'output')
-        os.makedirs(output_dir, exist_ok=True)
+        logger.info("Command completed with return code: %s", result.returncode)
         
-        # Save uploaded file
-        logger.info(f"Saving uploaded file to: {input_file_path}")
-        file.save(input_file_path)
-        saved_size = os.path.getsize(input_file_path)
-        logger.info(f"File saved. Size: {saved_size / (1024*1024):.2f} MB")
+        if result.returncode != 0:
+            error_details = result.stderr or result.stdout
+            logger.error("=" * 60)
+            logger.error("PROTECTION FAILED")
+            logger.error("=" * 60)
+            logger.error("Return code: %s", result.returncode)
+            logger.error("STDERR:\n%s", result.stderr)
+            logger.error("STDOUT:\n%s", result.stdout)
+            logger.error("=" * 60)
+            return {
+                'error': 'Protection failed',
+                'details': error_details
+            }, 500
         
-        # Check if Java is available (Windows compatible)
-        java_path = os.environ.get('JAVA_HOME', '')
-        if java_path:
-            # Windows uses 'bin\java.exe', Linux/Mac uses 'bin/java'
-            java_exe = 'java.exe' if os.name == 'nt' else 'java'
-            java_cmd = os.path.join(java_path, 'bin', java_exe)
-            if not os.path.exists(java_cmd):
-                java_cmd = 'java.exe' if os.name == 'nt' else 'java'
-        else:
-            java_cmd = 'java.exe' if os.name == 'nt' else 'java'
+        # Find the output file - dpt.jar creates signed APK with _signed suffix
+        logger.info("Searching for output file...")
+        output_file = find_output_file(output_dir, input_file_path)
         
-        logger.info(f"Using Java command: {java_cmd}")
+        if not output_file:
+            logger.error("=" * 60)
+            logger.error("NO OUTPUT FILE GENERATED")
+            logger.error("=" * 60)
+            logger.error("Output directory: %s", output_dir)
+            logger.error("Directory contents: %s", os.listdir(output_dir) if os.path.exists(output_dir) else 'Directory does not exist')
+            logger.error("STDOUT:\n%s", result.stdout)
+            logger.error("STDERR:\n%s", result.stderr)
+            logger.error("=" * 60)
+            return {
+                'error': 'No output file generated',
+                'details': result.stdout or result.stderr or 'No output file found in output directory'
+            }, 500
+        
+        logger.info("Using output file: %s", output_file)
+        
+        # Verify file exists and is not empty
+        if not os.path.exists(output_file):
+            logger.error("Output file does not exist: %s", output_file)
+            return {
+                'error': 'Output file not found',
+                'details': f'The protection process completed but the output file was not found: {output_file}'
+            }, 500
+        
+        file_size = os.path.getsize(output_file)
+        if file_size == 0:
+            logger.error("Output file is empty: %s", output_file)
+            return {
+                'error': 'Output file is empty',
+                'details': 'The protection process completed but generated an empty file. Please try again.'
+            }, 500
+        
+        logger.info("Output file verified. Size: %.2f MB", file_size / (1024*1024))
+        
+        # Verify APK signature (always verify since signing is always enabled)
+        try:
+            logger.info("Verifying APK signature...")
+            # Read the signing block inline - a few KB of I/O instead of a signer JVM per job
+            signature_valid = await asyncio.to_thread(has_apk_signing_block, output_file)
+            if signature_valid:
+                logger.info("APK Signing Block found (v2+ signature)")
+            
+            # Fall back to apksigner / jarsigner (e.g. v1-only signed AAB files)
+            apksigner_cmd = None
+            jarsigner_cmd = None
+            
+            # Try to find apksigner (Android SDK)
+            android_home = os.environ.get('ANDROID_HOME') or os.environ.get('ANDROID_SDK_ROOT')
+            if android_home and not signature_valid:
+                apksigner_path = os.path.join(android_home, 'build-tools')
+                if os.path.exists(apksigner_path):
+                    # Find latest build-tools version
+                    build_tools = [d for d in os.listdir(apksigner_path) if os.path.isdir(os.path.join(apksigner_path, d))]
+                    if build_tools:
+                        latest_version = sorted(build_tools, reverse=True)[0]
+                        apksigner_cmd = os.path.join(apksigner_path, latest_version, 'apksigner.bat' if os.name == 'nt' else 'apksigner')
+                        if not os.path.exists(apksigner_cmd):
+                            apksigner_cmd = None
+            
+            # Check if jarsigner is available (comes with JDK)
+            java_path = os.environ.get('JAVA_HOME', '')
+            if java_path:
+                jarsigner_exe = 'jarsigner.exe' if os.name == 'nt' else 'jarsigner'
+                jarsigner_cmd = os.path.join(java_path, 'bin', jarsigner_exe)
+                if not os.path.exists(jarsigner_cmd):
+                    jarsigner_cmd = 'jarsigner.exe' if os.name == 'nt' else 'jarsigner'
+            else:
+                jarsigner_cmd = 'jarsigner.exe' if os.name == 'nt' else 'jarsigner'
+            
+            # Try to verify signature
+            if apksigner_cmd and os.path.exists(apksigner_cmd):
+                try:
+                    verify_result = await run_command(
+                        [apksigner_cmd, 'verify', '--print-certs', output_file],
+                        timeout=30
+                    )
+                    if verify_result.returncode == 0:
+                        signature_valid = True
+                        logger.info("APK signature verified using apksigner")
+                    else:
+                        logger.warning("APK signature verification failed: %s", verify_result.stderr)
+                except Exception as e:
+                    logger.warning("Could not verify with apksigner: %s", e)
+            
+            if not signature_valid and jarsigner_cmd:
+                try:
+                    verify_result = await run_command(
+                        [jarsigner_cmd, '-verify', '-verbose', '-certs', output_file],
+                        timeout=30
+                    )
+                    if verify_result.returncode == 0 and 'jar verified' in verify_result.stdout.lower():
+                        signature_valid = True
+                        logger.info("APK signature verified using jarsigner")
+                    else:
+                        logger.warning("APK signature verification failed or APK is not signed")
+                except Exception as e:
+                    logger.warning("Could not verify with jarsigner: %s", e)
+            
+            if not signature_valid:
+                logger.warning("=" * 60)
+                logger.warning("APK SIGNATURE WARNING")
+                logger.warning("=" * 60)
+                logger.warning("The protected APK may not be properly signed.")
+                logger.warning("This can cause 'package appears to be invalid' error on Android.")
+                logger.warning("dpt.jar should sign the APK by default, but verification failed.")
+                logger.warning("=" * 60)
+            else:
+                logger.info("APK is properly signed and ready for installation")
+                
+        except Exception as e:
+            logger.warning("Could not verify APK signature: %s", e)
+            logger.warning("Continuing anyway - APK should be signed by dpt.jar")
         
-        # Verify Java is installed
+        # Verify the output file without reading it into memory - it is streamed to the client on collection
         try:
-            logger.info("Verifying Java installation...")
-            java_check = subprocess.run(
-                [java_cmd, '-version'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            logger.info(f"Java check output: {java_check.stderr[:100] if java_check.stderr else 'OK'}")
-        except subprocess.TimeoutExpired:
-            error_msg = 'Java verification timed out'
-            logger.error(f"ERROR: {error_msg}")
-            return jsonify({
-                'error': 'Java JDK 21 is not installed or not found in PATH',
-                'details': 'Please ensure Java JDK 21 is installed and JAVA_HOME is set correctly.'
-            }), 500
-        except FileNotFoundError:
-            error_msg = 'Java command not found'
-            logger.error(f"ERROR: {error_msg}")
-            logger.error(f"Java command path: {java_cmd}")
-            logger.error(f"JAVA_HOME: {java_path if java_path else 'Not set'}")
-            return jsonify({
-                'error': 'Java JDK 21 is not installed or not found in PATH',
-                'details': 'Please ensure Java JDK 21 is installed and JAVA_HOME is set correctly.'
-            }), 500
+            logger.info("Checking output file: %s", output_file)
+            
+            # Verify file is a valid APK/AAB before sending
+            if not os.path.exists(output_file):
+                logger.error("Output file does not exist: %s", output_file)
+                return {
+                    'error': 'Output file not found',
+                    'details': 'The protection process completed but the output file was not found.'
+                }, 500
+            
+            file_size = os.path.getsize(output_file)
+            
+            # Verify file is not corrupted (basic check - APK/AAB should start with ZIP signature)
+            if file_size < 4:
+                logger.error("Output file is too small to be valid!")
+                return {
+                    'error': 'Protected file is invalid',
+                    'details': 'The generated file is too small to be a valid APK/AAB file.'
+                }, 500
+            
+            # Check for ZIP signature (APK/AAB files are ZIP archives)
+            async with aiofiles.open(output_file, 'rb') as f:
+                zip_signature = await f.read(2)
+            if zip_signature != b'PK':
+                logger.warning("File may not be a valid APK/AAB (missing ZIP signature). Signature: %s", zip_signature)
+                # Continue anyway as some files might be valid
+            
+            logger.info("File signature check: %s", 'Valid ZIP' if zip_signature == b'PK' else 'Warning: May not be ZIP format')
+            
+        except IOError as e:
+            logger.error("Error reading output file: %s", e)
+            return {
+                'error': 'Failed to read protected file',
+                'details': f'Could not read the output file: {str(e)}'
+            }, 500
         except Exception as e:
-            error_msg = f'Error checking Java: {str(e)}'
-            logger.error(f"ERROR: {error_msg}")
+            logger.error("Unexpected error reading file: %s", e)
             logger.error(traceback.format_exc())
-            return jsonify({
-                'error': 'Java JDK 21 is not installed or not found in PATH',
-                'details': f'Error: {str(e)}'
-            }), 500
-        
-        # Build command exactly as per dpt.jar usage: java -jar dpt.jar [option] -f <package_file> -o <output_dir>
-        # Note: APK is signed by default (no --no-sign option used)
-        cmd = [java_cmd, '-jar', DPT_JAR_PATH]
-        
-        # Add options based on form data (before -f and -o as per usage)
-        options_used = []
-        
-        # Protect config (must come before -f)
-        if request.form.get('use_protect_config') == 'true':
-            config_file = os.path.join(os.path.dirname(__file__), 'executable', 'dpt-protect-config-template.json')
-            if os.path.exists(config_file):
-                cmd.extend(['-c', config_file])
-                options_used.append('protect-config')
-        
-        # Debug mode
-        if request.form.get('debug') == 'true':
-            cmd.append('--debug')
-            options_used.append('debug')
+            return {
+                'error': 'Unexpected error reading file',
+                'details': str(e)
+            }, 500
         
-        # Disable ACF
-        if request.form.get('disable_acf') == 'true':
-            cmd.append('--disable-acf')
-            options_used.append('disable-acf')
-        
-        # Dump code
-        if request.form.get('dump_code') == 'true':
-            cmd.append('--dump-code')
-            options_used.append('dump-code')
-        
-        # Exclude ABIs (must come before -f)
-        exclude_abis = request.form.get('exclude_abis', '').strip()
-        if exclude_abis:
-            cmd.extend(['-e', exclude_abis])
-            options_used.append(f'exclude-abis: {exclude_abis}')
-        
-        # Required: package file (-f)
-        cmd.extend(['-f', input_file_path])
-        
-        # Keep classes (-K)
-        if request.form.get('keep_classes') == 'true':
-            cmd.append('-K')
-            options_used.append('keep-classes')
-        
-        # Noisy log
-        if request.form.get('noisy_log') == 'true':
-            cmd.append('--noisy-log')
-            options_used.append('noisy-log')
-        
-        # Required: output directory (-o)
-        cmd.extend(['-o', output_dir])
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("=" * 60)
+            logger.info("PROTECTION SUCCESSFUL!")
+            logger.info("Output file: %s", job.output_filename)
+            logger.info("File size: %.2f MB", file_size / (1024*1024))
+            logger.info("=" * 60)
         
-        # Smaller size (-S)
-        if request.form.get('smaller') == 'true':
-            cmd.append('-S')
-            options_used.append('smaller')
+        job.output_file = output_file
+        job.file_size = file_size
+        return None
         
-        # APK will always be signed by dpt.jar (default behavior, no --no-sign option)
-        logger.info("APK will be signed by dpt.jar (default behavior - no --no-sign option)")
+    except asyncio.TimeoutError:
+        logger.error("=" * 60)
+        logger.error("PROCESS TIMEOUT")
+        logger.error("=" * 60)
+        logger.error("The APK protection process timed out after 5 minutes (free tier limit).")
+        logger.error("The APK might be too large or complex.")
+        logger.error("=" * 60)
         
-        logger.info(f"Options selected: {', '.join(options_used) if options_used else 'None'}")
-        logger.info(f"Running command: {' '.join(cmd)}")
+        return {'error': 'Process timed out. Free tier limit: 5 minutes processing time. Please try a smaller APK (max 150MB) or wait and retry.'}, 500
+    except Exception as e:
+        error_type = type(e).__name__
+        error_msg = str(e) if str(e) else "Unknown error"
+        error_traceback = traceback.format_exc()
         
-        # Get current working directory to restore later
-        original_cwd = os.getcwd()
+        # Log all error information together to prevent missing messages
+        error_log = f"""
+{'=' * 60}
+ERROR RUNNING PROTECTION
+{'=' * 60}
+Error type: {error_type}
+Error message: {error_msg}
+Full traceback:
+{error_traceback}
+{'=' * 60}
+"""
+        logger.error(error_log)
         
-        # Change to temp directory to prevent creating folders in project root
-        # This prevents dump-code from creating package name folders in project directory
-        os.chdir(temp_dir)
+        return {'error': f'Error running protection: {str(e)}'}, 500
+
+async def run_protection_job(job, *args):
+    """Background task for a ProtectionJob: run it, then expire it if it is never collected"""
+    job.error = await run_protection(job, *args)
+    if job.error:
+        discard_dir(job.temp_dir)
+    logger.info("Protection job finished: %s (%s)", job.id, 'failed' if job.error else 'ready')
+    log_buffer.flush()
+    asyncio.get_running_loop().call_later(JOB_RESULT_TTL, expire_job, job.id)
+
+def expire_job(job_id):
+    """Drop a finished job nobody collected, along with its files"""
+    job = protection_jobs.pop(job_id, None)
+    if job:
+        logger.info("Protection job expired: %s", job_id)
+        discard_dir(job.temp_dir)
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+@app.route('/protect', methods=['POST'])
+async def protect_apk():
+    try:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("=" * 60)
+            logger.info("Acx Shell - APK Protection Request Received")
+            logger.info("=" * 60)
         
-        # Run the command
-        try:
-            logger.info("Starting APK protection process...")
-            logger.info(f"Working directory: {temp_dir}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300,  # 5 minutes timeout (Render free tier optimized)
-                cwd=temp_dir  # Run from temp directory
-            )
+        # Temporary directory for processing - discarded on the way out unless a job takes it over
+        with ProtectionWorkspace() as workspace:
+            temp_dir = workspace.temp_dir
+            output_dir = workspace.output_dir
             
-            logger.info(f"Command completed with return code: {result.returncode}")
-            
-            if result.returncode != 0:
-                error_details = result.stderr or result.stdout
-                logger.error("=" * 60)
-                logger.error("PROTECTION FAILED")
-                logger.error("=" * 60)
-                logger.error(f"Return code: {result.returncode}")
-                logger.error(f"STDERR:\n{result.stderr}")
-                logger.error(f"STDOUT:\n{result.stdout}")
-                logger.error("=" * 60)
-                return jsonify({
-                    'error': 'Protection failed',
-                    'details': error_details
-                }), 500
+            # Stream the multipart body straight to disk - the original filename is
+            # only known once the part headers are parsed, so save under a fixed name
+            upload_path = os.path.join(temp_dir, 'upload.tmp')
+            file_target = HashingFileTarget(upload_path, max_size=MAX_UPLOAD_SIZE)
+            form_targets = {name: ValueTarget() for name in FORM_FIELDS}
             
-            # Find the output file - dpt.jar creates signed APK with _signed suffix
-            logger.info("Searching for output file...")
-            output_files = []
-            
-            # First, check for signed APK (dpt.jar default output)
-            signed_patterns = ['_signed.apk', '_signed.aab', '.apk', '.aab']
-            
-            for root, dirs, files in os.walk(output_dir):
-                for f in files:
-                    if f.endswith(('.apk', '.aab')):
-                        full_path = os.path.join(root, f)
-                        output_files.append(full_path)
-                        logger.info(f"Found potential output file: {full_path}")
-            
-            # Prioritize signed APK files
-            signed_files = [f for f in output_files if '_signed' in os.path.basename(f)]
-            if signed_files:
-                output_files = signed_files
-            
-            if not output_files:
-                logger.error("=" * 60)
-                logger.error("NO OUTPUT FILE GENERATED")
-                logger.error("=" * 60)
-                logger.error(f"Output directory: {output_dir}")
-                logger.error(f"Directory contents: {os.listdir(output_dir) if os.path.exists(output_dir) else 'Directory does not exist'}")
-                logger.error(f"STDOUT:\n{result.stdout}")
-                logger.error(f"STDERR:\n{result.stderr}")
-                logger.error("=" * 60)
-                return jsonify({
-                    'error': 'No output file generated',
-                    'details': result.stdout or result.stderr or 'No output file found in output directory'
-                }), 500
+            try:
+                parser = StreamingFormDataParser(headers=request.headers)
+                parser.register('apk_file', file_target)
+                for name, target in form_targets.items():
+                    parser.register(name, target)
+                
+                # Parsing and disk writes run in a worker thread so the event loop stays free
+                logger.info("Saving uploaded file to: %s", upload_path)
+                buffer = bytearray()
+                # Going over MAX_UPLOAD_SIZE raises RequestEntityTooLarge, answered by the 413 error handler
+                async for data in request.body:
+                    buffer += data
+                    if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                        await asyncio.to_thread(parser.data_received, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(parser.data_received, bytes(buffer))
+            except ParseFailedException as e:
+                # Not multipart/form-data (urlencoded form, empty body) or a malformed part
+                error_msg = 'No APK file provided'
+                logger.error("ERROR: %s (%s)", error_msg, e)
+                return jsonify({'error': error_msg, 'details': 'The request is not a valid multipart/form-data upload.'}), 400
             
-            output_file = output_files[0]
-            logger.info(f"Using output file: {output_file}")
+            # A body cut off before the file part's closing boundary parses without error - don't pass the partial file to dpt.jar
+            if file_target.multipart_filename is not None and not file_target.finished:
+                error_msg = 'Incomplete upload'
+                logger.error("ERROR: %s (%d bytes received)", error_msg, file_target.size)
+                return jsonify({'error': error_msg, 'details': 'The APK file upload was truncated. Please try again.'}), 400
             
-            # Verify file exists and is not empty
-            if not os.path.exists(output_file):
-                logger.error(f"Output file does not exist: {output_file}")
-                return jsonify({
-                    'error': 'Output file not found',
-                    'details': f'The protection process completed but the output file was not found: {output_file}'
-                }), 500
+            form = {name: target.value.decode('utf-8', errors='replace') for name, target in form_targets.items()}
+            # Only --dump-code writes outside output_dir, so everything else takes the fast path (pooled JVM)
+            dump_code = form.get('dump_code') == 'true'
             
-            file_size = os.path.getsize(output_file)
-            if file_size == 0:
-                logger.error(f"Output file is empty: {output_file}")
-                return jsonify({
-                    'error': 'Output file is empty',
-                    'details': 'The protection process completed but generated an empty file. Please try again.'
-                }), 500
+            # Check if file is present
+            if file_target.multipart_filename is None:
+                error_msg = 'No APK file provided'
+                logger.error("ERROR: %s", error_msg)
+                return jsonify({'error': error_msg}), 400
             
-            logger.info(f"Output file verified. Size: {file_size / (1024*1024):.2f} MB")
+            original_filename = file_target.multipart_filename
+            if original_filename == '':
+                error_msg = 'No file selected'
+                logger.error("ERROR: %s", error_msg)
+                return jsonify({'error': error_msg}), 400
             
-            # Verify APK signature (always verify since signing is always enabled)
-            try:
-                logger.info("Verifying APK signature...")
-                # Check if APK is signed using apksigner (Android SDK tool)
-                # If apksigner is not available, we'll try jarsigner
-                apksigner_cmd = None
-                jarsigner_cmd = None
-                
-                # Try to find apksigner (Android SDK)
-                android_home = os.environ.get('ANDROID_HOME') or os.environ.get('ANDROID_SDK_ROOT')
-                if android_home:
-                    apksigner_path = os.path.join(android_home, 'build-tools')
-                    if os.path.exists(apksigner_path):
-                        # Find latest build-tools version
-                        build_tools = [d for d in os.listdir(apksigner_path) if os.path.isdir(os.path.join(apksigner_path, d))]
-                        if build_tools:
-                            latest_version = sorted(build_tools, reverse=True)[0]
-                            apksigner_cmd = os.path.join(apksigner_path, latest_version, 'apksigner.bat' if os.name == 'nt' else 'apksigner')
-                            if not os.path.exists(apksigner_cmd):
-                                apksigner_cmd = None
-                
-                # Check if jarsigner is available (comes with JDK)
-                java_path = os.environ.get('JAVA_HOME', '')
-                if java_path:
-                    jarsigner_exe = 'jarsigner.exe' if os.name == 'nt' else 'jarsigner'
-                    jarsigner_cmd = os.path.join(java_path, 'bin', jarsigner_exe)
-                    if not os.path.exists(jarsigner_cmd):
-                        jarsigner_cmd = 'jarsigner.exe' if os.name == 'nt' else 'jarsigner'
-                else:
-                    jarsigner_cmd = 'jarsigner.exe' if os.name == 'nt' else 'jarsigner'
-                
-                # Try to verify signature
-                signature_valid = False
-                if apksigner_cmd and os.path.exists(apksigner_cmd):
-                    try:
-                        verify_result = subprocess.run(
-                            [apksigner_cmd, 'verify', '--print-certs', output_file],
-                            capture_output=True,
-                            text=True,
-                            timeout=30
-                        )
-                        if verify_result.returncode == 0:
-                            signature_valid = True
-                            logger.info("APK signature verified using apksigner")
-                        else:
-                            logger.warning(f"APK signature verification failed: {verify_result.stderr}")
-                    except Exception as e:
-                        logger.warning(f"Could not verify with apksigner: {e}")
-                
-                if not signature_valid and jarsigner_cmd:
-                    try:
-                        verify_result = subprocess.run(
-                            [jarsigner_cmd, '-verify', '-verbose', '-certs', output_file],
-                            capture_output=True,
-                            text=True,
-                            timeout=30
-                        )
-                        if verify_result.returncode == 0 and 'jar verified' in verify_result.stdout.lower():
-                            signature_valid = True
-                            logger.info("APK signature verified using jarsigner")
-                        else:
-                            logger.warning("APK signature verification failed or APK is not signed")
-                    except Exception as e:
-                        logger.warning(f"Could not verify with jarsigner: {e}")
-                
-                if not signature_valid:
-                    logger.warning("=" * 60)
-                    logger.warning("APK SIGNATURE WARNING")
-                    logger.warning("=" * 60)
-                    logger.warning("The protected APK may not be properly signed.")
-                    logger.warning("This can cause 'package appears to be invalid' error on Android.")
-                    logger.warning("dpt.jar should sign the APK by default, but verification failed.")
-                    logger.warning("=" * 60)
-                else:
-                    logger.info("APK is properly signed and ready for installation")
-                    
-            except Exception as e:
-                logger.warning(f"Could not verify APK signature: {e}")
-                logger.warning("Continuing anyway - APK should be signed by dpt.jar")
-            
-            # Restore original working directory
-            os.chdir(original_cwd)
-            
-            # Clean up any folders created in project root by dump-code
-            # These folders are created with package names like com.spiderautobet
-            project_root = os.path.dirname(os.path.abspath(__file__))
-            logger.info("Cleaning up any folders created in project root...")
+            if not original_filename.lower().endswith(('.apk', '.aab')):
+                error_msg = 'Invalid file type. Only APK and AAB files are supported'
+                logger.error("ERROR: %s", error_msg)
+                return jsonify({'error': error_msg}), 400
             
-            try:
-                for item in os.listdir(project_root):
-                    item_path = os.path.join(project_root, item)
-                    # Check if it's a directory that looks like a package name (contains dots)
-                    if os.path.isdir(item_path) and '.' in item and item != 'venv' and not item.startswith('.'):
-                        # Check if it contains .json files (dump-code output)
-                        has_json = False
-                        try:
-                            for root, dirs, files in os.walk(item_path):
-                                if any(f.endswith('.json') for f in files):
-                                    has_json = True
-                                    break
-                        except:
-                            pass
-                        
-                        if has_json:
-                            logger.info(f"Removing dump-code folder: {item_path}")
-                            try:
-                                shutil.rmtree(item_path, ignore_errors=True)
-                                logger.info(f"Successfully removed: {item}")
-                            except Exception as e:
-                                logger.warning(f"Could not remove {item_path}: {e}")
-            except Exception as e:
-                logger.warning(f"Error during cleanup: {e}")
-            
-            # Generate a unique filename
-            output_filename = f"protected_{secure_filename(file.filename)}"
-            
-            # Read file into memory before cleanup - with error handling and verification and verification
-            try:
-                logger.info(f"Reading output file: {output_file}")
-                
-                # Verify file is a valid APK/AAB before reading
-                if not os.path.exists(output_file):
-                    logger.error(f"Output file does not exist: {output_file}")
-                    return jsonify({
-                        'error': 'Output file not found',
-                        'details': 'The protection process completed but the output file was not found.'
-                    }), 500
-                
-                # Read file in binary mode to preserve integrity
-                with open(output_file, 'rb') as f:
-                    file_data = f.read()
-                
-                if not file_data or len(file_data) == 0:
-                    logger.error("Output file is empty!")
-                    return jsonify({
-                        'error': 'Protected file is empty',
-                        'details': 'The protection process completed but generated an empty file. Please try again.'
-                    }), 500
-                
-                # Verify file is not corrupted (basic check - APK/AAB should start with ZIP signature)
-                if len(file_data) < 4:
-                    logger.error("Output file is too small to be valid!")
-                    return jsonify({
-                        'error': 'Protected file is invalid',
-                        'details': 'The generated file is too small to be a valid APK/AAB file.'
-                    }), 500
-                
-                # Check for ZIP signature (APK/AAB files are ZIP archives)
-                zip_signature = file_data[:2]
-                if zip_signature != b'PK':
-                    logger.warning(f"File may not be a valid APK/AAB (missing ZIP signature). Signature: {zip_signature}")
-                    # Continue anyway as some files might be valid
-                
-                logger.info(f"File read successfully. Size: {len(file_data) / (1024*1024):.2f} MB")
-                logger.info(f"File signature check: {'Valid ZIP' if zip_signature == b'PK' else 'Warning: May not be ZIP format'}")
-                
-            except IOError as e:
-                logger.error(f"Error reading output file: {e}")
-                return jsonify({
-                    'error': 'Failed to read protected file',
-                    'details': f'Could not read the output file: {str(e)}'
-                }), 500
-            except Exception as e:
-                logger.error(f"Unexpected error reading file: {e}")
-                logger.error(traceback.format_exc())
-                return jsonify({
-                    'error': 'Unexpected error reading file',
-                    'details': str(e)
-                }), 500
+            logger.info("Processing file: %s", original_filename)
             
-            # Cleanup temporary directory and any project root folders (after reading file)
-            try:
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                # Also clean up any package name folders created in project root by dump-code
-                project_root = os.path.dirname(os.path.abspath(__file__))
-                if os.path.exists(project_root):
-                    for item in os.listdir(project_root):
-                        item_path = os.path.join(project_root, item)
-                        if os.path.isdir(item_path) and '.' in item and item != 'venv' and not item.startswith('.'):
-                            # Check if it contains .json files (dump-code output)
-                            try:
-                                has_json = False
-                                for root, dirs, files in os.walk(item_path):
-                                    if any(f.endswith('.json') for f in files):
-                                        has_json = True
-                                        break
-                                if has_json:
-                                    logger.info(f"Cleaning up dump-code folder: {item}")
-                                    shutil.rmtree(item_path, ignore_errors=True)
-                            except Exception as cleanup_error:
-                                logger.warning(f"Error cleaning up {item_path}: {cleanup_error}")
-            except Exception as cleanup_error:
-                logger.warning(f"Error during cleanup: {cleanup_error}")
+            # File size is enforced while streaming (150MB limit for Render free tier)
+            logger.info("File size: %.2f MB (within 150MB free tier limit)", file_target.size / (1024*1024))
             
-            logger.info("=" * 60)
-            logger.info("PROTECTION SUCCESSFUL!")
-            logger.info(f"Output file: {output_filename}")
-            logger.info(f"File size: {len(file_data) / (1024*1024):.2f} MB")
-            logger.info("=" * 60)
+            # File hash is computed incrementally while the upload streams to disk
+            file_hash = file_target.hash.hexdigest()
+            logger.info("File hash (%s): %s", HASH_NAME, file_hash)
             
-            # Create response from memory with proper headers for large files - crash prevention
-            from io import BytesIO
-            from flask import Response
+            # Check if file was already protected (check if filename starts with "protected_")
+            if original_filename.startswith('protected_'):
+                error_msg = 'This file appears to be already protected. Please upload the original APK file, not the protected version.'
+                logger.warning("Duplicate protection attempt detected: %s", original_filename)
+                return jsonify({'error': error_msg}), 400
             
-            try:
-                file_size = len(file_data)
-                file_size_mb = file_size / (1024 * 1024)
-                
-                logger.info(f"Preparing file response. Size: {file_size_mb:.2f} MB ({file_size} bytes)")
-                
-                # For very large files, ensure we're using BytesIO correctly
-                file_stream = BytesIO(file_data)
-                file_stream.seek(0)  # Reset to beginning
-                
-                # Verify file stream is valid
-                if file_stream.tell() != 0:
-                    file_stream.seek(0)
-                
-                response = Response(
-                    file_stream,
-                    mimetype='application/vnd.android.package-archive',
-                    headers={
-                        'Content-Disposition': f'attachment; filename="{output_filename}"',
-                        'Content-Length': str(file_size),
-                        'Content-Type': 'application/vnd.android.package-archive',
-                        'Cache-Control': 'no-cache, no-store, must-revalidate',
-                        'Pragma': 'no-cache',
-                        'Expires': '0',
-                        'Accept-Ranges': 'bytes',
-                        'Connection': 'keep-alive'
-                    },
-                    direct_passthrough=False  # Ensure Flask handles the streaming
-                )
-                
-                logger.info(f"File response created. Headers set. Starting transfer...")
-                return response
-                
-            except Exception as response_error:
-                logger.error(f"Error creating response: {response_error}")
-                logger.error(traceback.format_exc())
+            # dpt.jar derives the output name from the input file name
+            input_file_path = os.path.join(temp_dir, secure_filename(original_filename))
+            os.rename(upload_path, input_file_path)
+            logger.info("File saved to: %s. Size: %.2f MB", input_file_path, file_target.size / (1024*1024))
+            
+            # Check if Java is available (probed once at startup)
+            java_cmd = JAVA_CMD
+            
+            logger.info("Using Java command: %s", java_cmd)
+            
+            if not JAVA_AVAILABLE:
+                error_msg = 'Java command not found'
+                logger.error("ERROR: %s", error_msg)
+                logger.error("Java command path: %s", java_cmd)
+                logger.error("JAVA_HOME: %s", os.environ.get('JAVA_HOME') or 'Not set')
                 return jsonify({
-                    'error': 'Failed to create file response',
-                    'details': f'Error: {str(response_error)}'
+                    'error': 'Java JDK 21 is not installed or not found in PATH',
+                    'details': 'Please ensure Java JDK 21 is installed and JAVA_HOME is set correctly.'
                 }), 500
             
-        except subprocess.TimeoutExpired:
-            # Restore original working directory
-            try:
-                os.chdir(original_cwd)
-            except:
-                pass
+            logger.info("Java version: %s", JAVA_VERSION)
             
-            # Cleanup on timeout
-            logger.error("=" * 60)
-            logger.error("PROCESS TIMEOUT")
-            logger.error("=" * 60)
-            logger.error("The APK protection process timed out after 5 minutes (free tier limit).")
-            logger.error("The APK might be too large or complex.")
-            logger.error("=" * 60)
+            # Build command exactly as per dpt.jar usage: java -jar dpt.jar [option] -f <package_file> -o <output_dir>
+            # Note: APK is signed by default (no --no-sign option used)
+            dpt_args = []
             
-            # Clean up temp directory and any project root folders
-            try:
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                # Clean up any package name folders in project root
-                project_root = os.path.dirname(os.path.abspath(__file__))
-                for item in os.listdir(project_root):
-                    item_path = os.path.join(project_root, item)
-                    if os.path.isdir(item_path) and '.' in item and item != 'venv' and not item.startswith('.'):
-                        try:
-                            shutil.rmtree(item_path, ignore_errors=True)
-                        except:
-                            pass
-            except:
-                pass
-            return jsonify({'error': 'Process timed out. Free tier limit: 5 minutes processing time. Please try a smaller APK (max 150MB) or wait and retry.'}), 500
-        except Exception as e:
-            # Restore original working directory
-            try:
-                os.chdir(original_cwd)
-            except:
-                pass
+            # Add options based on form data (before -f and -o as per usage)
+            options_used = []
             
-            # Cleanup on error
-            error_type = type(e).__name__
-            error_msg = str(e) if str(e) else "Unknown error"
-            error_traceback = traceback.format_exc()
+            # Protect config (must come before -f)
+            if form.get('use_protect_config') == 'true':
+                config_file = os.path.join(os.path.dirname(__file__), 'executable', 'dpt-protect-config-template.json')
+                if os.path.exists(config_file):
+                    dpt_args.extend(['-c', config_file])
+                    options_used.append('protect-config')
             
-            # Log all error information together to prevent missing messages
-            error_log = f"""
-{'=' * 60}
-ERROR RUNNING PROTECTION
-{'=' * 60}
-Error type: {error_type}
-Error message: {error_msg}
-Full traceback:
-{error_traceback}
-{'=' * 60}
-"""
-            logger.error(error_log)
+            # Boolean switches (dpt.jar parses with commons-cli, so their position doesn't matter)
+            for key, flag in OPTION_FLAGS:
+                if form.get(key) == 'true':
+                    dpt_args.append(flag)
+                    options_used.append(key.replace('_', '-'))
             
-            # Clean up temp directory and any project root folders
-            try:
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                # Clean up any package name folders in project root
-                project_root = os.path.dirname(os.path.abspath(__file__))
-                for item in os.listdir(project_root):
-                    item_path = os.path.join(project_root, item)
-                    if os.path.isdir(item_path) and '.' in item and item != 'venv' and not item.startswith('.'):
-                        try:
-                            shutil.rmtree(item_path, ignore_errors=True)
-                        except:
-                            pass
-            except:
-                pass
-            return jsonify({'error': f'Error running protection: {str(e)}'}), 500
-    
+            # Exclude ABIs (must come before -f)
+            exclude_abis = form.get('exclude_abis', '').strip()
+            if exclude_abis:
+                dpt_args.extend(['-e', exclude_abis])
+                options_used.append(f'exclude-abis: {exclude_abis}')
+            
+            # Required: package file (-f) and output directory (-o)
+            dpt_args.extend(['-f', input_file_path, '-o', output_dir])
+            
+            # APK will always be signed by dpt.jar (default behavior, no --no-sign option)
+            logger.info("APK will be signed by dpt.jar (default behavior - no --no-sign option)")
+            
+            # java.io.tmpdir keeps dpt.jar's unpacked build in the workspace
+            cmd = [java_cmd, f'-Djava.io.tmpdir={temp_dir}', '-jar', DPT_JAR_PATH] + dpt_args
+            if dump_code:
+                # user.dir pins dump-code output (package name folders) inside temp_dir instead of the project root
+                cmd.insert(1, f'-Duser.dir={temp_dir}')
+            
+            logger.info("Options selected: %s", ', '.join(options_used) if options_used else 'None')
+            logger.info("Running command: %s", ' '.join(cmd))
+            
+            # Hand the dpt.jar run to a background job so the request doesn't have to stay open for it
+            # The job owns temp_dir from here on and cleans it up itself
+            job = ProtectionJob(workspace.detach(), f"protected_{secure_filename(original_filename)}")
+            protection_jobs[job.id] = job
+            use_pool = dpt_pool is not None and not dump_code
+            job.task = asyncio.create_task(
+                run_protection_job(job, cmd, dpt_args, input_file_path, output_dir, use_pool)
+            )
+            logger.info("Protection job submitted: %s", job.id)
+            return jsonify({'job_id': job.id, 'status': 'pending'}), 202
+        
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         error_type = type(e).__name__
         error_msg = str(e) if str(e) else "Unknown error"
@@ -647,59 +824,110 @@ Full traceback:
         logger.error(error_log)
         return jsonify({'error': f'Server error: {error_msg}'}), 500
 
-@app.route('/health', methods=['GET'])
-def health():
-    # Check Java availability (Windows compatible)
-    java_available = False
-    java_version = 'Not found'
+@app.errorhandler(413)
+async def request_entity_too_large(error):
+    error_msg = f'File exceeds maximum allowed size ({MAX_UPLOAD_SIZE // (1024*1024)} MB) for free tier. Please use a smaller APK file.'
+    logger.error("ERROR: %s", error_msg)
+    return jsonify({'error': error_msg}), 413
+
+@app.route('/protect/<job_id>', methods=['GET'])
+async def protect_result(job_id):
+    job = protection_jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'error': 'Protection job not found',
+            'details': 'The job ID is unknown, or its result was already downloaded or has expired.'
+        }), 404
+    
+    if not job.task.done():
+        return jsonify({'job_id': job.id, 'status': 'pending'}), 202
+    
+    # A finished job can be collected once
+    protection_jobs.pop(job_id, None)
+    
+    if job.task.cancelled() or job.task.exception():
+        discard_dir(job.temp_dir)
+        return jsonify({'error': 'Protection job was interrupted. Please try again.'}), 500
+    
+    if job.error:
+        error_payload, status_code = job.error
+        return jsonify(error_payload), status_code
+    
+    # Stream the file from disk with proper headers for large files - crash prevention
     try:
-        java_path = os.environ.get('JAVA_HOME', '')
-        if java_path:
-            java_exe = 'java.exe' if os.name == 'nt' else 'java'
-            java_cmd = os.path.join(java_path, 'bin', java_exe)
-            if not os.path.exists(java_cmd):
-                java_cmd = 'java.exe' if os.name == 'nt' else 'java'
-        else:
-            java_cmd = 'java.exe' if os.name == 'nt' else 'java'
-        
-        result = subprocess.run(
-            [java_cmd, '-version'],
-            capture_output=True,
-            text=True,
-            timeout=5
+        file_size_mb = job.file_size / (1024 * 1024)
+        
+        logger.info("Preparing file response. Size: %.2f MB (%s bytes)", file_size_mb, job.file_size)
+        
+        response = Response(
+            stream_file(job.output_file, cleanup_dir=job.temp_dir),
+            mimetype='application/vnd.android.package-archive',
+            headers={
+                'Content-Disposition': f'attachment; filename="{job.output_filename}"',
+                'Content-Length': str(job.file_size),
+                'Content-Type': 'application/vnd.android.package-archive',
+                'Cache-Control': 'no-cache, no-store, must-revalidate',
+                'Pragma': 'no-cache',
+                'Expires': '0',
+                'Connection': 'keep-alive'
+            }
         )
-        java_available = True
-        java_version = result.stderr.split('\n')[0] if result.stderr else 'Unknown'
-    except:
-        pass
-    
-    return jsonify({
+        
+        logger.info("File response created. Headers set. Starting transfer...")
+        return response
+        
+    except Exception as response_error:
+        logger.error("Error creating response: %s", response_error)
+        logger.error(traceback.format_exc())
+        discard_dir(job.temp_dir)
+        return jsonify({
+            'error': 'Failed to create file response',
+            'details': f'Error: {str(response_error)}'
+        }), 500
+
+HEALTH_CACHE_TTL = 30  # Seconds between dpt.jar checks (orchestrators poll /health every few seconds)
+
+@lru_cache(maxsize=1)
+def health_snapshot(ttl_bucket):
+    """Build the /health payload; cached per TTL bucket of time.monotonic()."""
+    try:
+        # A zero-byte jar (truncated deploy) counts as missing
+        dpt_jar_exists = os.stat(DPT_JAR_PATH).st_size > 0
+    except OSError:
+        dpt_jar_exists = False
+    # Java availability is probed once at startup
+    return {
         'status': 'ok',
-        'dpt_jar_exists': os.path.exists(DPT_JAR_PATH),
-        'java_available': java_available,
-        'java_version': java_version
-    })
+        'dpt_jar_exists': dpt_jar_exists,
+        'java_available': JAVA_AVAILABLE,
+        'java_version': JAVA_VERSION
+    }
+
+@app.route('/health', methods=['GET'])
+async def health():
+    return jsonify(health_snapshot(int(time.monotonic() // HEALTH_CACHE_TTL)))
 
 # Add request logging middleware
 @app.before_request
-def log_request_info():
-    logger.info(f"Request: {request.method} {request.path}")
+async def log_request_info():
+    logger.info("Request: %s %s", request.method, request.path)
     if request.method == 'POST' and request.path == '/protect':
-        logger.info(f"Content-Type: {request.content_type}")
-        logger.info(f"Content-Length: {request.content_length} bytes")
+        logger.info("Content-Type: %s", request.content_type)
+        logger.info("Content-Length: %s bytes", request.content_length)
 
 @app.after_request
-def log_response_info(response):
-    logger.info(f"Response: {response.status_code} {response.status}")
+async def log_response_info(response):
+    logger.info("Response: %s %s", response.status_code, response.status)
     # Add headers for large file downloads
     if response.status_code == 200:
         content_length = response.headers.get('Content-Length')
         if content_length:
             file_size_mb = int(content_length) / (1024 * 1024)
-            logger.info(f"Response file size: {file_size_mb:.2f} MB")
+            logger.info("Response file size: %.2f MB", file_size_mb)
         content_type = response.headers.get('Content-Type', '')
         if content_type:
-            logger.info(f"Response Content-Type: {content_type}")
+            logger.info("Response Content-Type: %s", content_type)
+    log_buffer.flush()  # One batched stdout write per request
     return response
 
 if __name__ == '__main__':
@@ -707,8 +935,8 @@ if __name__ == '__main__':
     logger.info("=" * 60)
     logger.info("Acx Shell Server Starting")
     logger.info("=" * 60)
-    logger.info(f"Server running on: http://0.0.0.0:{port}")
-    logger.info(f"Local access: http://localhost:{port}")
+    logger.info("Server running on: http://0.0.0.0:%s", port)
+    logger.info("Local access: http://localhost:%s", port)
     logger.info("Press Ctrl+C to stop the server")
     logger.info("=" * 60)
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,88 @@
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Paths;
+import java.util.Base64;
+
+/**
+ * Acx Shell - long-lived dpt.jar runner used by the app's JVM pool.
+ *
+ * Usage: java -cp executable/worker DptWorker path/to/dpt.jar
+ *
+ * Reads one job per line from stdin: space separated Base64 (UTF-8) tokens,
+ * the log file path, the job's temp directory, then the dpt.jar arguments.
+ * Each job runs dpt's main() in a fresh class loader so no static state
+ * leaks between jobs, with stdout/stderr captured to the log file.
+ * java.io.tmpdir is pointed at the job's directory first: dpt unpacks into
+ * $tmpdir/dptOut (Const.ROOT_OF_OUT_DIR, re-read per loader), so jobs on
+ * different workers never share a workspace.
+ * Replies "DONE OK" or "DONE FAILED" on stdout when the job finishes.
+ */
+public class DptWorker {
+
+    public static void main(String[] args) throws Exception {
+        if (args.length != 1) {
+            System.err.println("Usage: java -cp executable/worker DptWorker <dpt.jar>");
+            System.exit(2);
+        }
+
+        URL[] classpath = { Paths.get(args[0]).toUri().toURL() };
+        PrintStream reply = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream originalOut = System.out;
+        PrintStream originalErr = System.err;
+        BufferedReader jobs = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        Base64.Decoder decoder = Base64.getDecoder();
+
+        String line;
+        while ((line = jobs.readLine()) != null) {
+            line = line.trim();
+            if (line.isEmpty()) {
+                continue;
+            }
+
+            String[] tokens = line.split(" ");
+            String logPath = new String(decoder.decode(tokens[0]), StandardCharsets.UTF_8);
+            String jobDir = new String(decoder.decode(tokens[1]), StandardCharsets.UTF_8);
+            String[] dptArgs = new String[tokens.length - 2];
+            for (int i = 2; i < tokens.length; i++) {
+                dptArgs[i - 2] = new String(decoder.decode(tokens[i]), StandardCharsets.UTF_8);
+            }
+
+            boolean ok = true;
+            try (PrintStream log = new PrintStream(new FileOutputStream(logPath), true, "UTF-8")) {
+                System.setOut(log);
+                System.setErr(log);
+                try (URLClassLoader loader = new URLClassLoader(classpath, ClassLoader.getPlatformClassLoader())) {
+                    // Must be set before dpt's Const class initializes in this loader
+                    System.setProperty("java.io.tmpdir", jobDir);
+                    Thread.currentThread().setContextClassLoader(loader);
+                    Class<?> dpt = Class.forName("com.luoye.dpt.Dpt", true, loader);
+                    Method dptMain = dpt.getMethod("main", String[].class);
+                    dptMain.invoke(null, (Object) dptArgs);
+                } catch (InvocationTargetException e) {
+                    ok = false;
+                    e.getCause().printStackTrace(log);
+                } catch (Throwable t) {
+                    ok = false;
+                    t.printStackTrace(log);
+                } finally {
+                    System.setOut(originalOut);
+                    System.setErr(originalErr);
+                    Thread.currentThread().setContextClassLoader(DptWorker.class.getClassLoader());
+                }
+            } catch (Exception e) {
+                ok = false;
+                e.printStackTrace(originalErr);
+            }
+
+            reply.println(ok ? "DONE OK" : "DONE FAILED");
+        }
+    }
+}
@@ -5,118 +5,233 @@ Automatically downloads dependencies, sets up environment, and runs the applicat
 """
 
 import os
+import re
 import sys
+import json
+import time
+import hashlib
+import asyncio
 import subprocess
-import platform
-import urllib.request
+import stat
+import venv
+import site
+import runpy
 import shutil
+from functools import partial
 from pathlib import Path
 
-# Colors for terminal output
+_IS_WINDOWS = os.name == 'nt'
+
+# pip / python commands inside the virtual environment
+if _IS_WINDOWS:
+    _VENV_PIP = os.path.join('venv', 'Scripts', 'pip.exe')
+    _VENV_PY = os.path.join('venv', 'Scripts', 'python.exe')
+else:
+    _VENV_PIP = os.path.join('venv', 'bin', 'pip')
+    _VENV_PY = os.path.join('venv', 'bin', 'python')
+
+# Toolchain probe cache - skips the java -version subprocess on warm runs
+CACHE_FILE = Path('.acx_cache.json')
+CACHE_TTL = 86400  # Re-probe at least once a day
+_cache = None
+
+# Java version parsing: `java -version` output and the JDK's release file
+_JAVA_VER_RE = re.compile(r'version "(\d+)')
+_JAVA_RELEASE_RE = re.compile(r'^JAVA_VERSION="([^"]+)"', re.MULTILINE)
+
+# requirements.txt hash of the last successful install into the venv
+REQ_HASH_FILE = Path('venv') / '.acx_req_hash'
+PIP_READY_FILE = Path('venv') / '.pip_ready'  # Set once ensurepip has run in the venv
+
+# Files the app needs to run, with the name each one is reported as when missing
+REQUIRED_PATHS = {
+    os.path.join('executable', 'dpt.jar'): 'dpt.jar',
+    os.path.join('templates', 'index.html'): 'templates',
+    'app.py': 'application',
+}
+
+# Colors for terminal output - plain text when piped or NO_COLOR is set (https://no-color.org)
+_USE_COLOR = sys.stdout.isatty() and not os.environ.get('NO_COLOR')
+
+def _ansi(code):
+    return f'\033[{code}m' if _USE_COLOR else ''
+
 class Colors:
-    GREEN = '\033[92m'
-    YELLOW = '\033[93m'
-    RED = '\033[91m'
-    BLUE = '\033[94m'
-    CYAN = '\033[96m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
+    GREEN = _ansi(92)
+    YELLOW = _ansi(93)
+    RED = _ansi(91)
+    BLUE = _ansi(94)
+    CYAN = _ansi(96)
+    RESET = _ansi(0)
+    BOLD = _ansi(1)
+
+# Prefixes built once instead of on every print
+_HDR_LINE = Colors.CYAN + "="*60 + Colors.RESET
+_HDR_PREFIX = Colors.BOLD + Colors.CYAN + "  "
+_SUCCESS_PREFIX = Colors.GREEN + "✓ "
+_ERROR_PREFIX = Colors.RED + "✗ "
+_WARNING_PREFIX = Colors.YELLOW + "⚠ "
 
 def print_colored(message, color=Colors.RESET):
     """Print colored message"""
-    print(f"{color}{message}{Colors.RESET}")
+    print(color + message + Colors.RESET)
 
 def print_header(text):
     """Print header"""
-    print_colored("\n" + "="*60, Colors.CYAN)
-    print_colored(f"  {text}", Colors.BOLD + Colors.CYAN)
-    print_colored("="*60 + "\n", Colors.CYAN)
+    sys.stdout.write(f"\n{_HDR_LINE}\n{_HDR_PREFIX}{text}{Colors.RESET}\n{_HDR_LINE}\n\n")
+    sys.stdout.flush()
 
 def print_step(step_num, text):
     """Print step"""
-    print_colored(f"[{step_num}] {text}", Colors.BLUE)
+    print(f"{Colors.BLUE}[{step_num}] {text}{Colors.RESET}")
 
 def print_success(text):
     """Print success message"""
-    print_colored(f"✓ {text}", Colors.GREEN)
+    print(_SUCCESS_PREFIX + text + Colors.RESET)
 
 def print_error(text):
     """Print error message"""
-    print_colored(f"✗ {text}", Colors.RED)
+    print(_ERROR_PREFIX + text + Colors.RESET)
 
 def print_warning(text):
     """Print warning message"""
-    print_colored(f"⚠ {text}", Colors.YELLOW)
+    print(_WARNING_PREFIX + text + Colors.RESET)
+
+def print_report(report):
+    """Print the buffered output of a check"""
+    for line in report:
+        line()
+
+def _stat_sig(cmd):
+    """Identify the binary behind cmd by path, mtime and size (None when not found)"""
+    path = shutil.which(cmd)
+    if not path:
+        return None
+    st = os.stat(path)
+    return [path, st.st_mtime_ns, st.st_size]
 
-def check_command(cmd):
-    """Check if command exists"""
+async def _cached_probe(key, probe, stat_sig=None, ttl=CACHE_TTL):
+    """Return await probe() from .acx_cache.json while key and stat_sig match and the entry is fresh"""
+    global _cache
+    digest = hashlib.blake2b(json.dumps(key).encode(), digest_size=16).hexdigest()
+    if _cache is None:
+        try:
+            _cache = json.loads(CACHE_FILE.read_text())
+        except (OSError, ValueError):
+            _cache = {}
+    entry = _cache.get(digest)
+    if entry and entry.get('stat_sig') == stat_sig and time.time() - entry.get('timestamp', 0) < ttl:
+        return entry['value']
+    
+    value = await probe()
+    _cache[digest] = {'value': value, 'stat_sig': stat_sig, 'timestamp': time.time()}
+    tmp_file = CACHE_FILE.with_name(f"{CACHE_FILE.name}.{os.getpid()}.tmp")
     try:
-        result = subprocess.run(
-            [cmd, '--version'] if cmd != 'java' else [cmd, '-version'],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        return result.returncode == 0
-    except:
-        return False
+        tmp_file.write_text(json.dumps(_cache))
+        os.replace(tmp_file, CACHE_FILE)  # Atomic - a concurrent run never reads a partial file
+    except OSError:
+        pass
+    return value
 
-def check_python():
-    """Check Python installation"""
-    print_step(1, "Checking Python installation...")
+def _toolchain_key(*parts):
+    """Cache key for a probe that depends on where the toolchain is looked up"""
+    return list(parts) + [os.environ.get('JAVA_HOME', ''), os.environ.get('PATH', '')]
+
+async def check_python():
+    """Check Python installation - returns (ok, report)"""
+    report = [partial(print_step, 1, "Checking Python installation...")]
     if sys.version_info < (3, 11):
-        print_error(f"Python 3.11+ required. Found: {sys.version}")
-        print_warning("Please install Python 3.11+ from https://www.python.org/downloads/")
-        return False
-    print_success(f"Python {sys.version.split()[0]} found")
-    return True
+        report.append(partial(print_error, f"Python 3.11+ required. Found: {sys.version}"))
+        report.append(partial(print_warning, "Please install Python 3.11+ from https://www.python.org/downloads/"))
+        return False, report
+    report.append(partial(print_success, f"Python {sys.version.split()[0]} found"))
+    return True, report
 
-def check_java():
-    """Check Java JDK 21 installation"""
-    print_step(2, "Checking Java JDK 21 installation...")
+async def check_java():
+    """Check Java JDK 21 installation - returns (ok, java_cmd, report)"""
+    report = [partial(print_step, 2, "Checking Java JDK 21 installation...")]
     
     # Check JAVA_HOME
     java_home = os.environ.get('JAVA_HOME', '')
     java_cmd = None
     
     if java_home:
-        java_exe = 'java.exe' if platform.system() == 'Windows' else 'java'
+        java_exe = 'java.exe' if _IS_WINDOWS else 'java'
         java_cmd = os.path.join(java_home, 'bin', java_exe)
         if not os.path.exists(java_cmd):
             java_cmd = None
     
     # Check if java is in PATH
     if not java_cmd or not os.path.exists(java_cmd):
-        if check_command('java'):
+        if shutil.which('java'):
             java_cmd = 'java'
         else:
-            print_error("Java JDK 21 not found!")
-            print_warning("Please install Java JDK 21:")
-            if platform.system() == 'Windows':
-                print("  Windows: https://adoptium.net/temurin/releases/?version=21")
+            report.append(partial(print_error, "Java JDK 21 not found!"))
+            report.append(partial(print_warning, "Please install Java JDK 21:"))
+            if _IS_WINDOWS:
+                report.append(partial(print, "  Windows: https://adoptium.net/temurin/releases/?version=21"))
             else:
-                print("  Linux/Mac: Use package manager or download from Adoptium")
-            return False, None
+                report.append(partial(print, "  Linux/Mac: Use package manager or download from Adoptium"))
+            return False, None, report
+    
+    # Check Java version from the JDK's release file - no JVM startup needed
+    release_version = _java_release_version(java_cmd)
+    if release_version:
+        if release_version.split('.')[0] == '21':
+            report.append(partial(print_success, f"Java JDK 21 found ({release_version})"))
+        else:
+            report.append(partial(print_warning, f"Java found but version might not be 21: {release_version}"))
+            report.append(partial(print_warning, "Continuing anyway..."))
+        return True, java_cmd, report
     
-    # Check Java version
+    # Fall back to java -version (cached until the java binary changes)
     try:
-        result = subprocess.run(
-            [java_cmd, '-version'],
-            capture_output=True,
-            text=True,
-            timeout=5
+        version_output = await _cached_probe(
+            _toolchain_key('java_version', java_cmd),
+            partial(_java_version_output, java_cmd),
+            _stat_sig(java_cmd)
         )
-        version_output = result.stderr or result.stdout
-        if '21' in version_output or 'openjdk version "21' in version_output:
-            print_success("Java JDK 21 found")
-            return True, java_cmd
+        match = _JAVA_VER_RE.search(version_output)
+        major = int(match.group(1)) if match else None
+        if major == 21:
+            report.append(partial(print_success, "Java JDK 21 found"))
+            return True, java_cmd, report
         else:
-            print_warning(f"Java found but version might not be 21: {version_output.split()[0] if version_output else 'Unknown'}")
-            print_warning("Continuing anyway...")
-            return True, java_cmd
+            report.append(partial(print_warning, f"Java found but version might not be 21: {version_output.split()[0] if version_output else 'Unknown'}"))
+            report.append(partial(print_warning, "Continuing anyway..."))
+            return True, java_cmd, report
     except Exception as e:
-        print_error(f"Error checking Java: {e}")
-        return False, None
+        report.append(partial(print_error, f"Error checking Java: {e}"))
+        return False, None, report
+
+def _java_release_version(java_cmd):
+    """Read JAVA_VERSION from the release file of the JDK that java_cmd belongs to"""
+    java_path = shutil.which(java_cmd)
+    if not java_path:
+        return None
+    # <jdk>/bin/java -> <jdk>/release (resolving /usr/bin/java style symlinks first)
+    release_file = Path(os.path.realpath(java_path)).parent.parent / 'release'
+    try:
+        match = _JAVA_RELEASE_RE.search(release_file.read_text())
+    except OSError:
+        return None
+    return match.group(1) if match else None
+
+async def _java_version_output(java_cmd):
+    """Run java -version and return its output"""
+    process = await asyncio.create_subprocess_exec(
+        java_cmd, '-version',
+        stdin=asyncio.subprocess.DEVNULL,  # Never let the probe read from the terminal
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=5)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    return (stderr or stdout).decode(errors='replace')
 
 def setup_virtual_environment():
     """Setup Python virtual environment"""
@@ -128,111 +243,205 @@ def setup_virtual_environment():
         print_success("Virtual environment already exists")
     else:
         try:
-            subprocess.run([sys.executable, '-m', 'venv', 'venv'], check=True)
+            # In-process and without pip - pip is bootstrapped later only if an install is needed
+            venv.EnvBuilder(symlinks=not _IS_WINDOWS, with_pip=False).create(str(venv_path))
             print_success("Virtual environment created")
-        except subprocess.CalledProcessError:
+        except (OSError, subprocess.CalledProcessError):
             print_error("Failed to create virtual environment")
             return False
     
     return True
 
-def get_pip_command():
-    """Get pip command for virtual environment"""
-    if platform.system() == 'Windows':
-        return str(Path('venv') / 'Scripts' / 'pip.exe')
-    else:
-        return str(Path('venv') / 'bin' / 'pip')
+def ensure_pip():
+    """Bootstrap pip into the virtual environment the first time it is needed"""
+    if os.path.isfile(PIP_READY_FILE) or os.path.isfile(_VENV_PIP):
+        return True
+    try:
+        print("Bootstrapping pip...")
+        subprocess.run([_VENV_PY, '-m', 'ensurepip', '--default-pip'], check=True, stdout=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        print_error("Failed to bootstrap pip in the virtual environment")
+        return False
+    PIP_READY_FILE.touch()
+    return True
 
-def get_python_command():
-    """Get python command for virtual environment"""
-    if platform.system() == 'Windows':
-        return str(Path('venv') / 'Scripts' / 'python.exe')
-    else:
-        return str(Path('venv') / 'bin' / 'python')
+def requirements_hash():
+    """Hash requirements.txt together with the interpreter the venv was built from"""
+    digest = hashlib.blake2b(Path('requirements.txt').read_bytes())
+    digest.update(str(os.stat(sys.executable).st_mtime_ns).encode())
+    return digest.hexdigest()
 
 def install_dependencies():
     """Install Python dependencies"""
     print_step(4, "Installing Python dependencies...")
     
-    pip_cmd = get_pip_command()
-    
-    # Upgrade pip first
-    try:
-        print("Upgrading pip...")
-        subprocess.run([pip_cmd, 'install', '--upgrade', 'pip'], check=True, capture_output=True)
-    except:
-        pass
+    pip_cmd = _VENV_PIP
     
     # Install requirements
-    if not Path('requirements.txt').exists():
+    if not os.path.isfile('requirements.txt'):
         print_error("requirements.txt not found!")
         return False
     
+    # Upgrade pip first - only on request, the venv's bundled pip is new enough for requirements.txt
+    # (checked before the up-to-date skip below so the flag works on warm runs too)
+    if '--upgrade-pip' in sys.argv[1:]:
+        if not ensure_pip():
+            return False
+        try:
+            print("Upgrading pip...")
+            subprocess.run([pip_cmd, 'install', '--upgrade', 'pip'], check=True, stdout=subprocess.DEVNULL)
+        except:
+            pass
+    
+    # Skip pip entirely when requirements.txt and the interpreter are unchanged since the last install
+    req_hash = requirements_hash()
     try:
+        if REQ_HASH_FILE.read_text() == req_hash:
+            print_success("Dependencies already up to date")
+            return True
+    except OSError:
+        pass
+    
+    if not ensure_pip():
+        return False
+    
+    wheels_dir = Path('wheels')
+    if wheels_dir.is_dir():
+        # Offline install from a local wheelhouse (pip download -r requirements.txt -d wheels)
+        print("Installing packages from wheels/ (offline)...")
+        pip_args = ['--no-index', '--find-links', str(wheels_dir)]
+        if all(wheel.suffix == '.whl' for wheel in wheels_dir.iterdir()):
+            # Nothing to build from source, so skip setting up an isolated build env
+            pip_args.append('--no-build-isolation')
+    else:
         print("Installing packages from requirements.txt...")
-        result = subprocess.run(
-            [pip_cmd, 'install', '-r', 'requirements.txt'],
-            check=True,
-            capture_output=True,
-            text=True
+        pip_args = ['--prefer-binary', '--disable-pip-version-check']
+    
+    try:
+        # pip writes straight to the terminal, so progress shows live and nothing is buffered here
+        subprocess.run(
+            [pip_cmd, 'install', *pip_args, '-r', 'requirements.txt'],
+            check=True
         )
         print_success("Dependencies installed successfully")
+        tmp_file = REQ_HASH_FILE.with_name(REQ_HASH_FILE.name + '.tmp')
+        tmp_file.write_text(req_hash)
+        os.replace(tmp_file, REQ_HASH_FILE)
         return True
     except subprocess.CalledProcessError as e:
-        print_error(f"Failed to install dependencies: {e.stderr}")
+        print_error(f"Failed to install dependencies (pip exited with code {e.returncode})")
         return False
 
-def check_dpt_jar():
-    """Check if dpt.jar exists"""
-    print_step(5, "Checking dpt.jar...")
+def verify_required():
+    """Stat all REQUIRED_PATHS in one pass - returns the names of the missing ones"""
+    missing = []
+    for path, name in REQUIRED_PATHS.items():
+        try:
+            if not stat.S_ISREG(os.stat(path).st_mode):
+                missing.append(name)
+        except OSError:
+            missing.append(name)
+    return missing
+
+def check_dpt_jar(missing):
+    """Check if dpt.jar exists - returns (ok, report)"""
+    report = [partial(print_step, 5, "Checking dpt.jar...")]
     
-    dpt_jar = Path('executable') / 'dpt.jar'
-    if dpt_jar.exists():
-        print_success("dpt.jar found")
-        return True
+    if 'dpt.jar' not in missing:
+        report.append(partial(print_success, "dpt.jar found"))
+        return True, report
     else:
-        print_error("dpt.jar not found in executable/ folder!")
-        print_warning("Please ensure dpt.jar is in the executable/ directory")
-        return False
+        report.append(partial(print_error, "dpt.jar not found in executable/ folder!"))
+        report.append(partial(print_warning, "Please ensure dpt.jar is in the executable/ directory"))
+        return False, report
 
-def check_templates():
-    """Check if templates exist"""
-    print_step(6, "Checking templates...")
+def check_templates(missing):
+    """Check if templates exist - returns (ok, report)"""
+    report = [partial(print_step, 6, "Checking templates...")]
     
-    template_file = Path('templates') / 'index.html'
-    if template_file.exists():
-        print_success("Templates found")
-        return True
+    if 'templates' not in missing:
+        report.append(partial(print_success, "Templates found"))
+        return True, report
     else:
-        print_error("templates/index.html not found!")
-        return False
+        report.append(partial(print_error, "templates/index.html not found!"))
+        return False, report
+
+async def run_checks():
+    """Run the independent pre-flight checks concurrently - returns {name: result}"""
+    python, java, required = await asyncio.gather(
+        check_python(), check_java(), asyncio.to_thread(verify_required)  # Blocking stats off the event loop
+    )
+    return {'python': python, 'java': java, 'required': required}
+
+def venv_site_packages():
+    """site-packages of the venv if it was built for this interpreter's Python version, else None"""
+    try:
+        with open(os.path.join('venv', 'pyvenv.cfg'), encoding='utf-8') as f:
+            cfg = dict(line.split('=', 1) for line in f if '=' in line)
+    except OSError:
+        return None
+    cfg = {key.strip(): value.strip() for key, value in cfg.items()}
+    version = cfg.get('version_info') or cfg.get('version', '')
+    py_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    if '.'.join(version.split('.')[:2]) != py_version:
+        return None
+    if _IS_WINDOWS:
+        return os.path.join('venv', 'Lib', 'site-packages')
+    return os.path.join('venv', 'lib', f'python{py_version}', 'site-packages')
 
-def run_application():
-    """Run the Flask application"""
+def run_application(missing):
+    """Run the Quart application"""
     print_header("Starting Acx Shell")
     
-    python_cmd = get_python_command()
-    app_file = Path('app.py')
+    python_cmd = _VENV_PY
+    app_file = 'app.py'
     
-    if not app_file.exists():
+    if 'application' in missing:
         print_error("app.py not found!")
         return False
     
     print_success("All checks passed!")
-    print_colored("\n" + "="*60, Colors.CYAN)
+    print("\n" + _HDR_LINE)
     print_colored("  Server starting...", Colors.BOLD + Colors.GREEN)
     print_colored("  Open your browser at: http://localhost:5000", Colors.CYAN)
     print_colored("  Press Ctrl+C to stop the server", Colors.YELLOW)
-    print_colored("="*60 + "\n", Colors.CYAN)
+    print(_HDR_LINE + "\n")
     
     try:
-        # Set environment variables
-        env = os.environ.copy()
-        port = env.get('PORT', '5000')
-        env['PORT'] = port
+        # Set environment variables (inherited by the server - no copy of the environment needed)
+        os.environ.setdefault('PORT', '5000')
         
         # Run the application
-        subprocess.run([python_cmd, str(app_file)], env=env)
+        site_packages = venv_site_packages()
+        if site_packages and os.path.isdir(site_packages):
+            # Same Python version as the venv - run app.py in this interpreter on the venv's packages
+            os.environ['VIRTUAL_ENV'] = os.path.abspath('venv')
+            outer_path = list(sys.path)
+            site.addsitedir(site_packages)  # Also processes the venv's .pth files
+            venv_path = [p for p in sys.path if p not in outer_path]
+            # Keep the stdlib first and the venv in place of this interpreter's site-packages,
+            # so app.py only sees packages installed in the venv
+            venv_site = os.path.abspath(site_packages)
+            outer_sites = tuple(
+                p for p in [*site.getsitepackages(), site.getusersitepackages()]
+                if os.path.abspath(p) != venv_site  # Already running inside the venv
+            )
+            base_path = [p for p in outer_path if not p.startswith(outer_sites)]
+            # Everything ahead of the first outer site-packages entry is kept, so its index carries over
+            insert_at = next((i for i, p in enumerate(outer_path) if p.startswith(outer_sites)), len(base_path))
+            sys.path[:] = base_path[:insert_at] + venv_path + base_path[insert_at:]
+            # Absolute path, so app.py's __file__-relative paths (dpt.jar, config template) survive a cwd change
+            app_path = os.path.abspath(app_file)
+            sys.argv = [app_path]
+            runpy.run_path(app_path, run_name='__main__')
+        elif _IS_WINDOWS:
+            # os.exec* on Windows starts a new process and returns to the prompt, so wait on a child there
+            subprocess.run([python_cmd, app_file])
+        else:
+            # Replace this process with the server - no idle parent interpreter, Ctrl+C goes straight to the app
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.execvp(python_cmd, [python_cmd, app_file])
     except KeyboardInterrupt:
         print_colored("\n\nServer stopped by user", Colors.YELLOW)
         return True
@@ -244,12 +453,18 @@ def main():
     """Main function"""
     print_header("Acx Shell - Auto Setup")
     
+    # Checks run in parallel up front; their output is printed below in step order
+    results = asyncio.run(run_checks())
+    
     # Check Python
-    if not check_python():
+    python_ok, report = results['python']
+    print_report(report)
+    if not python_ok:
         sys.exit(1)
     
     # Check Java
-    java_ok, java_cmd = check_java()
+    java_ok, java_cmd, report = results['java']
+    print_report(report)
     if not java_ok:
         print_warning("\nYou can still continue, but APK protection won't work without Java.")
         response = input("Continue anyway? (y/n): ").lower()
@@ -265,20 +480,25 @@ def main():
         print_warning("Some dependencies failed to install. Continuing anyway...")
     
     # Check dpt.jar
-    if not check_dpt_jar():
+    missing = results['required']
+    dpt_jar_ok, report = check_dpt_jar(missing)
+    print_report(report)
+    if not dpt_jar_ok:
         print_warning("dpt.jar not found. APK protection will not work.")
         response = input("Continue anyway? (y/n): ").lower()
         if response != 'y':
             sys.exit(1)
     
     # Check templates
-    if not check_templates():
+    templates_ok, report = check_templates(missing)
+    print_report(report)
+    if not templates_ok:
         print_error("Templates missing. Cannot start application.")
         sys.exit(1)
     
     # Run application
     print_header("Setup Complete!")
-    run_application()
+    run_application(missing)
 
 if __name__ == '__main__':
     try: